@@ -6,26 +6,91 @@ Usage:
     python server.py
 
 Endpoints:
-    GET  /voices     — list available Kokoro voices
-    POST /synthesize — synthesize text to audio with word-level timestamps
+    GET  /voices             — list available Kokoro voices
+    POST /synthesize         — synthesize text to audio with word-level timestamps
+                               (WAV; Ogg Opus or FLAC when the Accept header asks)
+    POST /synthesize/stream  — stream WAV audio chunk by chunk as it is generated
+    POST /synthesize/events  — stream audio chunks + word timestamps as SSE
+
+Environment:
+    KOKORO_SYNTH_WORKERS   — concurrent syntheses, each on its own thread (default 8)
+    KOKORO_BATCH_WINDOW_MS — longest wait for already-submitted forwards to
+                             join a model batch (default 20)
+    KOKORO_MAX_BATCH       — maximum rows per model batch (default 8)
+    KOKORO_CACHE_ENTRIES   — finished syntheses kept in the LRU cache (default 512)
+    KOKORO_CACHE_MB        — total audio size kept in the LRU cache (default 256)
+    KOKORO_G2P_CACHE       — phonemized texts kept per language (default 4096)
+    KOKORO_DTYPE           — model weight precision: fp32 (default), bf16, int8
+    KOKORO_PRELOAD_LANGS   — lang codes loaded at startup (default "a,b,p")
+    KOKORO_DEVICE          — torch device for the model (default: cuda, then mps
+                             if PYTORCH_ENABLE_MPS_FALLBACK=1, then cpu)
+    KOKORO_THREADS         — torch intra-op CPU threads (default: half the cores)
+    KOKORO_COMPILE         — 1 to torch.compile the decoder, warmed up at startup
 """
 
+import asyncio
 import base64
+import copy
+import hashlib
 import io
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict, defaultdict
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 import numpy as np
+import orjson
 import soundfile as sf
-from fastapi import FastAPI
+import torch
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from kokoro import KModel, KPipeline
 from pydantic import BaseModel
 
 # ---------------------------------------------------------------------------
 # Globals populated at startup
 # ---------------------------------------------------------------------------
+REPO_ID = "hexgrad/Kokoro-82M"
+kmodel: KModel | None = None  # shared by every KPipeline
 pipelines: dict = {}  # lang_code → KPipeline
 SAMPLE_RATE = 24000
 
+# Silence padded around the audio to prevent clipping at start/end of playback
+PAD_SAMPLES = int(SAMPLE_RATE * 0.08)  # 80ms
+PAD_SECONDS = PAD_SAMPLES / SAMPLE_RATE
+_SILENCE_PCM = bytes(PAD_SAMPLES * 2)  # int16 zeros; immutable, so shared by every stream
+
+# Worker threads running Kokoro's generator, one per in-flight synthesis
+SYNTH_WORKERS = int(os.environ.get("KOKORO_SYNTH_WORKERS", "8"))
+
+# Cross-request batching of model forwards
+BATCH_WINDOW_MS = float(os.environ.get("KOKORO_BATCH_WINDOW_MS", "20"))
+MAX_BATCH = int(os.environ.get("KOKORO_MAX_BATCH", "8"))
+
+# Inference device; None picks the best available one
+KOKORO_DEVICE = os.environ.get("KOKORO_DEVICE") or None
+
+# CPU threads per process, leaving headroom for other workers and the encoders
+TORCH_THREADS = int(os.environ.get("KOKORO_THREADS") or max(1, (os.cpu_count() or 2) // 2))
+
+# torch.compile the decoder when the model loads
+KOKORO_COMPILE = os.environ.get("KOKORO_COMPILE") == "1"
+
+# Reduced-precision weights, applied when the model loads
+KOKORO_DTYPE = os.environ.get("KOKORO_DTYPE", "fp32").lower()
+if KOKORO_DTYPE not in ("fp32", "bf16", "int8"):
+    raise ValueError(f"KOKORO_DTYPE must be fp32, bf16 or int8, got {KOKORO_DTYPE!r}")
+
+# LRU cache of finished syntheses
+CACHE_MAX_ENTRIES = int(os.environ.get("KOKORO_CACHE_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.environ.get("KOKORO_CACHE_MB", "256")) * 1024 * 1024
+G2P_CACHE_SIZE = int(os.environ.get("KOKORO_G2P_CACHE", "4096"))
+
 # Voice ID prefix → lang_code for KPipeline
 VOICE_LANG_MAP = {
     "a": "a",   # American English (af_, am_)
@@ -49,33 +114,173 @@ VOICES = [
     {"id": "pm_alex", "label": "Alex (BR, Male)", "lang": "p"},
     {"id": "pm_santa", "label": "Santa (BR, Male)", "lang": "p"},
 ]
+VOICE_ID_TO_LANG = {v["id"]: v["lang"] for v in VOICES}
+
+PRELOAD_LANGS = [c for c in os.environ.get("KOKORO_PRELOAD_LANGS", "a,b,p").replace(" ", "").split(",") if c]
+if unknown := set(PRELOAD_LANGS) - set(VOICE_LANG_MAP.values()):
+    raise ValueError(f"Unknown lang codes in KOKORO_PRELOAD_LANGS: {sorted(unknown)}")
+
+# Pipelines load from worker threads: one lock for the model, one per language
+_model_lock = threading.Lock()
+_pipeline_locks = {code: threading.Lock() for code in VOICE_LANG_MAP.values()}
 
 
 # ---------------------------------------------------------------------------
 # Startup / shutdown
 # ---------------------------------------------------------------------------
+def _apply_dtype(model):
+    """
+    Lower weight precision per KOKORO_DTYPE. Only the parts whose consumers
+    tolerate it are touched: Kokoro calls LSTM.flatten_parameters (missing on
+    quantized LSTMs) and the decoder's iSTFT needs fp32 complex math.
+      int8 — dynamic int8 quantization of every nn.Linear (CPU only)
+      bf16 — ALBERT runs in bfloat16 and hands fp32 back to the rest of the model
+    """
+    if KOKORO_DTYPE == "int8":
+        if model.device.type != "cpu":
+            print(f"KOKORO_DTYPE=int8 is CPU-only, keeping fp32 on {model.device}.")
+            return model
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if KOKORO_DTYPE == "bf16":
+        model.bert.to(torch.bfloat16)
+        model.bert.register_forward_hook(lambda _module, _args, output: output.float())
+    return model
+
+
+def _compile_decoder(model) -> None:
+    """Swap in a shape-dynamic torch.compile'd decoder; it compiles on first call (see _warm_up)."""
+    try:
+        model.decoder = torch.compile(model.decoder, dynamic=True)
+    except Exception as exc:
+        print(f"KOKORO_COMPILE: torch.compile unavailable, keeping eager decoder ({exc}).")
+
+
+def _warm_up() -> None:
+    """Synthesize a short phrase per preloaded language so the compile happens before any request."""
+    try:
+        for code in PRELOAD_LANGS:
+            pipe = pipelines[code]
+            voice = next(v["id"] for v in VOICES if v["lang"] == code)
+            with torch.inference_mode():
+                for _ in pipe("Hello.", voice=voice):
+                    pass
+    except Exception as exc:
+        kmodel.decoder = getattr(kmodel.decoder, "_orig_mod", kmodel.decoder)
+        print(f"KOKORO_COMPILE: warm-up failed, falling back to the eager decoder ({exc}).")
+
+
+def _configure_torch() -> None:
+    """Process-wide torch threading: a fixed intra-op pool, no inter-op pool."""
+    torch.set_num_threads(TORCH_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # already set, or parallel work has started
+        pass
+
+
+def _select_device() -> torch.device:
+    """KOKORO_DEVICE if set, else the best available device (same order as KPipeline)."""
+    if KOKORO_DEVICE:
+        return torch.device(KOKORO_DEVICE)
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    # Some Kokoro ops have no MPS kernel, so MPS needs the CPU fallback enabled
+    if os.environ.get("PYTORCH_ENABLE_MPS_FALLBACK") == "1" and torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def _get_model() -> KModel:
+    """Get or lazily load the Kokoro model. It is language-blind, so one copy serves every pipeline."""
+    global kmodel
+    with _model_lock:
+        if kmodel is None:
+            print("Loading Kokoro model …")
+            device = _select_device()
+            if device.type == "cuda":
+                torch.backends.cuda.matmul.allow_tf32 = True
+                torch.backends.cudnn.allow_tf32 = True
+            kmodel = _apply_dtype(KModel(repo_id=REPO_ID).to(device).eval())
+            if KOKORO_COMPILE:
+                _compile_decoder(kmodel)
+            print(f"Kokoro model ready on {device}.")
+        return kmodel
+
+
+class _CachedG2P:
+    """
+    LRU in front of a pipeline's g2p (text → (phonemes, tokens)). G2P output is
+    deterministic per text and language, so repeated prompts skip spaCy/espeak.
+    Kokoro writes timestamps onto the returned MTokens, so entries are stored
+    and handed out as deep copies. Called from concurrent worker threads.
+    """
+
+    def __init__(self, g2p, maxsize: int):
+        self._g2p = g2p
+        self._maxsize = maxsize
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str):
+        with self._lock:
+            hit = self._entries.get(text)
+            if hit is not None:
+                self._entries.move_to_end(text)
+        if hit is not None:
+            return copy.deepcopy(hit)
+
+        result = self._g2p(text)
+        with self._lock:
+            self._entries[text] = copy.deepcopy(result)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._g2p, name)
+
+
 def _get_pipeline(lang_code: str):
     """Get or lazily create a KPipeline for the given language."""
-    if lang_code not in pipelines:
-        from kokoro import KPipeline
-        print(f"Loading Kokoro pipeline for lang_code='{lang_code}' …")
-        pipelines[lang_code] = KPipeline(lang_code=lang_code)
-        print(f"Kokoro pipeline (lang_code='{lang_code}') ready.")
-    return pipelines[lang_code]
+    with _pipeline_locks[lang_code]:
+        if lang_code not in pipelines:
+            print(f"Loading Kokoro pipeline for lang_code='{lang_code}' …")
+            pipe = KPipeline(lang_code=lang_code, repo_id=REPO_ID, model=_get_model())
+            if G2P_CACHE_SIZE > 0:
+                pipe.g2p = _CachedG2P(pipe.g2p, G2P_CACHE_SIZE)
+            pipelines[lang_code] = pipe
+            print(f"Kokoro pipeline (lang_code='{lang_code}') ready.")
+        return pipelines[lang_code]
 
 
 def _lang_for_voice(voice_id: str) -> str:
-    """Derive the lang_code from a voice ID prefix (e.g. 'pf_dora' → 'p')."""
-    prefix = voice_id[0] if voice_id else "a"
-    return VOICE_LANG_MAP.get(prefix, "a")
+    """
+    Resolve a voice ID to its lang_code: listed voices by lookup, other Kokoro
+    voices by their prefix (e.g. 'pf_dora' → 'p'). Anything else is rejected
+    with a 400 before a pipeline is loaded.
+    """
+    lang_code = VOICE_ID_TO_LANG.get(voice_id) or VOICE_LANG_MAP.get(voice_id[:1])
+    if lang_code is None:
+        raise HTTPException(status_code=400, detail=f"Unknown voice: {voice_id!r}")
+    return lang_code
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Pre-load American English on startup
-    _get_pipeline("a")
+    global kmodel
+    _configure_torch()
+    # Load the model and G2P for every preloaded language up front, in
+    # parallel, so no request pays the first-load cost
+    await asyncio.gather(*(asyncio.to_thread(_get_pipeline, code) for code in PRELOAD_LANGS))
+    if KOKORO_COMPILE and PRELOAD_LANGS:
+        print("Compiling the Kokoro decoder …")
+        await asyncio.to_thread(_warm_up)
+    batcher.start()
     yield
+    await batcher.stop()
+    cache.clear()
     pipelines.clear()
+    kmodel = None
 
 
 app = FastAPI(title="Kokoro TTS Server", lifespan=lifespan)
@@ -97,6 +302,8 @@ class SynthesizeRequest(BaseModel):
     speed: float = 1.0
 
 
+# WordTimestamp / SynthesizeResponse document the response schema; handlers
+# build plain dicts and serialize them with orjson instead of validating them
 class WordTimestamp(BaseModel):
     word: str
     start: float
@@ -104,145 +311,664 @@ class WordTimestamp(BaseModel):
 
 
 class SynthesizeResponse(BaseModel):
-    audio: str  # base64-encoded WAV
+    audio: str  # base64-encoded audio file
     timestamps: list[WordTimestamp]
     sample_rate: int
+    format: str = "audio/wav"  # media type of `audio`
+
+
+# ---------------------------------------------------------------------------
+# Batching
+# ---------------------------------------------------------------------------
+def _to_device(tensor: torch.Tensor, device: torch.device) -> torch.Tensor:
+    """Host → device copy, staged through pinned memory so CUDA copies asynchronously."""
+    if tensor.device == device:
+        return tensor
+    if device.type == "cuda":
+        return tensor.pin_memory().to(device, non_blocking=True)
+    return tensor.to(device)
+
+
+def _to_host(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Device → host copy. CUDA copies land in pinned memory without blocking;
+    call torch.cuda.current_stream().synchronize() before reading them.
+    """
+    if tensor.device.type != "cuda":
+        return tensor.cpu()
+    host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+    return host.copy_(tensor, non_blocking=True)
+
+
+@torch.inference_mode()
+def _forward_batch(model, batch: list[tuple[str, torch.Tensor, float]]) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Batched equivalent of KModel.forward for [(phonemes, ref_s, speed), ...].
+
+    ALBERT, the duration predictor and the text encoder are mask-aware (their
+    LSTMs run over packed sequences), so they run once over the padded batch.
+    Alignment, F0/noise prediction and the decoder use InstanceNorm over time,
+    where padding would change the output, so those run per row at the row's
+    exact length. Returns (audio, pred_dur) per row, on the CPU. A batch of
+    one takes the same path, so its results come back through pinned memory too.
+    """
+    device = model.device
+    ids = []
+    for phonemes, _, _ in batch:
+        row = [model.vocab[p] for p in phonemes if p in model.vocab]
+        assert len(row) + 2 <= model.context_length
+        ids.append(torch.LongTensor([0, *row, 0]))
+
+    lengths = [len(row) for row in ids]
+    input_lengths = _to_device(torch.tensor(lengths), device)
+    input_ids = _to_device(torch.nn.utils.rnn.pad_sequence(ids, batch_first=True), device)
+    text_mask = torch.arange(input_ids.shape[1], device=device).unsqueeze(0).expand(len(ids), -1)
+    text_mask = torch.gt(text_mask + 1, input_lengths.unsqueeze(1))
+    ref_s = torch.cat([_to_device(ref, device) for _, ref, _ in batch])
+    speed = _to_device(torch.tensor([[spd] for _, _, spd in batch]), device)
+
+    bert_dur = model.bert(input_ids, attention_mask=(~text_mask).int())
+    d_en = model.bert_encoder(bert_dur).transpose(-1, -2)
+    d = model.predictor.text_encoder(d_en, ref_s[:, 128:], input_lengths, text_mask)
+    # Packed like ProsodyPredictor.forward, so the backward direction starts at each row's last token
+    x = torch.nn.utils.rnn.pack_padded_sequence(d, torch.tensor(lengths), batch_first=True, enforce_sorted=False)
+    x, _ = model.predictor.lstm(x)
+    x, _ = torch.nn.utils.rnn.pad_packed_sequence(x, batch_first=True, total_length=d.shape[1])
+    duration = torch.sigmoid(model.predictor.duration_proj(x)).sum(axis=-1) / speed
+    pred_dur = torch.round(duration).clamp(min=1).long()
+    t_en = model.text_encoder(input_ids, input_lengths, text_mask)
+
+    outputs = []
+    for row, n_tokens in enumerate(lengths):
+        row_dur = pred_dur[row, :n_tokens]
+        indices = torch.repeat_interleave(torch.arange(n_tokens, device=device), row_dur)
+        pred_aln_trg = torch.zeros((n_tokens, indices.shape[0]), device=device)
+        pred_aln_trg[indices, torch.arange(indices.shape[0], device=device)] = 1
+        pred_aln_trg = pred_aln_trg.unsqueeze(0)
+
+        s = ref_s[row:row + 1]
+        en = d[row:row + 1, :n_tokens].transpose(-1, -2) @ pred_aln_trg
+        F0_pred, N_pred = model.predictor.F0Ntrain(en, s[:, 128:])
+        asr = t_en[row:row + 1, :, :n_tokens] @ pred_aln_trg
+        audio = model.decoder(asr, F0_pred, N_pred, s[:, :128]).squeeze()
+        outputs.append((_to_host(audio), _to_host(row_dur)))
+
+    if device.type == "cuda":
+        torch.cuda.current_stream(device).synchronize()
+    return outputs
+
+
+class _BatchedModel:
+    """
+    Stand-in for a KModel, passed to KPipeline.__call__ as `model=`. The
+    pipeline still does G2P, chunking and timestamp joining per request; only
+    the forward pass is routed through the batcher.
+    """
+
+    def __init__(self, model, dispatcher: "ModelBatcher"):
+        self.model = model
+        self.device = model.device
+        self._dispatcher = dispatcher
+
+    def __call__(self, phonemes: str, ref_s: torch.Tensor, speed: float = 1, return_output: bool = False):
+        audio, pred_dur = self._dispatcher.submit(self.model, phonemes, ref_s, speed)
+        return KModel.Output(audio=audio, pred_dur=pred_dur) if return_output else audio
+
+
+class ModelBatcher:
+    """
+    Collects forward calls from concurrent requests for up to BATCH_WINDOW_MS
+    (or MAX_BATCH calls), runs them as one batch per model on a dedicated
+    thread, and hands each row back to the request thread that submitted it.
+    The window only stays open for forwards already submitted, so no batch
+    waits on a request that is still in G2P or behind a slow client.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._inflight: list[tuple] = []
+        self._closed = False  # set by stop(); later submits fail instead of queueing
+        self._pending = 0  # forwards submitted but not yet collected
+        self._pending_lock = threading.Lock()
+        # Single worker: batches run one at a time, and never compete with the
+        # default executor where request threads block on their results.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kokoro-batch")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._closed = False
+        self._pending = 0
+        self._task = self._loop.create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._closed = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # Unblock request threads still waiting on a forward
+        abandoned = self._inflight
+        while not self._queue.empty():
+            abandoned.append(self._queue.get_nowait())
+        for *_, future in abandoned:
+            if not future.done():
+                future.set_exception(RuntimeError("Model batcher stopped"))
+        self._inflight = []
+
+    def wrap(self, model) -> _BatchedModel | None:
+        """Batching proxy for `model`, or None (use the model as-is) when not running."""
+        return _BatchedModel(model, self) if self.running and MAX_BATCH > 1 else None
+
+    def submit(self, model, phonemes: str, ref_s: torch.Tensor, speed: float) -> tuple[torch.Tensor, torch.Tensor]:
+        """Queue one forward from a worker thread and block until its batch has run."""
+        if self._closed:
+            raise RuntimeError("Model batcher stopped")
+        future: Future = Future()
+        item = (model, phonemes, ref_s, speed, future)
+        with self._pending_lock:
+            self._pending += 1
+
+        def enqueue() -> None:
+            # Runs on the loop, so it is ordered against stop(): either queued
+            # before stop() drains the queue, or failed here
+            if self._closed:
+                future.set_exception(RuntimeError("Model batcher stopped"))
+            else:
+                self._queue.put_nowait(item)
+
+        self._loop.call_soon_threadsafe(enqueue)
+        return future.result()
+
+    async def _collect(self) -> None:
+        """
+        Fill self._inflight with the next batch: the first forward plus every
+        other one submitted by then, waiting at most the window for those still
+        crossing over from their threads. A lone forward dispatches at once.
+        """
+        self._inflight = [await self._next()]
+        deadline = self._loop.time() + BATCH_WINDOW_MS / 1000
+        while len(self._inflight) < MAX_BATCH and self._pending > 0:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                self._inflight.append(await asyncio.wait_for(self._next(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _next(self) -> tuple:
+        item = await self._queue.get()
+        with self._pending_lock:
+            self._pending -= 1
+        return item
+
+    async def _dispatch(self) -> None:
+        while True:
+            await self._collect()
+
+            # Rows can only share a forward if they target the same model
+            groups: dict[int, list[tuple]] = defaultdict(list)
+            for item in self._inflight:
+                groups[id(item[0])].append(item)
+
+            for items in groups.values():
+                model = items[0][0]
+                rows = [(phonemes, ref_s, speed) for _, phonemes, ref_s, speed, _ in items]
+                try:
+                    outputs = await self._loop.run_in_executor(self._executor, _forward_batch, model, rows)
+                except Exception as exc:
+                    for *_, future in items:
+                        future.set_exception(exc)
+                else:
+                    for (*_, future), output in zip(items, outputs):
+                        future.set_result(output)
+
+
+batcher = ModelBatcher()
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+class SynthesisCache:
+    """
+    LRU of finished syntheses: key → (audio_bytes, timestamps), per format.
+    Bounded both by entry count and by total audio bytes. Only touched from
+    the event loop.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[bytes, list[dict]]] = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def key(req: SynthesizeRequest, media_type: str = "audio/wav") -> str:
+        raw = f"{media_type}|{req.voice}|{req.speed}|{req.text}"
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> tuple[bytes, list[dict]] | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, audio: bytes, timestamps: list[dict]) -> None:
+        if len(audio) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key)[0])
+        self._entries[key] = (audio, timestamps)
+        self._bytes += len(audio)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+
+cache = SynthesisCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
-def _audio_to_base64_wav(audio_np: np.ndarray, sr: int) -> str:
-    buf = io.BytesIO()
-    sf.write(buf, audio_np, sr, format="WAV")
-    return base64.b64encode(buf.getvalue()).decode()
+def _to_pcm16(audio_np: np.ndarray) -> np.ndarray:
+    """Convert float audio in [-1, 1] to int16 PCM samples (scaled and clipped in place)."""
+    scaled = np.multiply(audio_np, 32767, dtype=np.float32)
+    np.clip(scaled, -32767, 32767, out=scaled)
+    return scaled.astype(np.int16)
+
+
+# Placeholder size for RIFF/data chunks whose length is unknown up front
+_WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def _wav_header(sr: int, data_bytes: int = _WAV_UNKNOWN_SIZE) -> bytes:
+    """44-byte RIFF header for mono 16-bit PCM. Defaults to an open-ended stream."""
+    riff_size = _WAV_UNKNOWN_SIZE if data_bytes == _WAV_UNKNOWN_SIZE else 36 + data_bytes
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sr, sr * 2, 2, 16,
+        b"data", data_bytes,
+    )
+
+
+def _pcm_to_wav(pcm: np.ndarray, sr: int) -> bytes:
+    """Complete WAV file for int16 PCM samples."""
+    return _wav_header(sr, pcm.nbytes) + pcm.tobytes()
 
 
 DURATION_DIVISOR = 80.0  # converts pred_dur ticks → seconds
 
 
-def _extract_word_timestamps(tokens: list | None, graphemes: str, pred_dur, audio_len: int) -> list[WordTimestamp]:
+# Compressed formats a client can ask for in Accept → libsndfile (format, subtype)
+# Media type reported to the client → soundfile (format, subtype); WAV is built by hand
+AUDIO_FORMATS = {
+    "audio/ogg; codecs=opus": ("OGG", "OPUS"),
+    "audio/flac": ("FLAC", "PCM_16"),
+}
+
+
+def _accepted_format(media_type: str, params: dict[str, str]) -> str | None:
+    """The format we would send for one Accept media range, or None if we can't produce it."""
+    if media_type in ("audio/wav", "audio/*", "*/*"):
+        return "audio/wav"
+    if media_type == "audio/opus" or (media_type == "audio/ogg" and params.get("codecs", "opus") == "opus"):
+        return "audio/ogg; codecs=opus"
+    if media_type == "audio/flac":
+        return "audio/flac"
+    return None
+
+
+def _negotiate_format(accept: str | None) -> str | None:
+    """
+    Highest-q format in Accept that we can produce, the earliest on ties.
+    WAV is the fallback unless the client declined it (q=0, directly or via a
+    wildcard); None means every format we produce was declined.
+    """
+    offers: list[tuple[str, float, bool]] = []  # (format, q, named explicitly)
+    for entry in (accept or "").split(","):
+        media_type, *raw_params = entry.split(";")
+        media_type = media_type.strip().lower()
+        params = {}
+        for param in raw_params:
+            name, _, value = param.partition("=")
+            params[name.strip().lower()] = value.strip().strip('"').lower()
+        if (fmt := _accepted_format(media_type, params)) is None:
+            continue
+        try:
+            q = float(params.get("q", "1"))
+        except ValueError:
+            q = 0.0
+        offers.append((fmt, q, "*" not in media_type))
+
+    # A specific q=0 beats a wildcard that would otherwise allow the format
+    declined = {fmt for fmt, q, explicit in offers if q <= 0 and explicit}
+    best, best_q = None, 0.0
+    for fmt, q, explicit in offers:
+        if q > best_q and (explicit or fmt not in declined):
+            best, best_q = fmt, q
+    if best is None and not any(fmt == "audio/wav" and q <= 0 for fmt, q, _ in offers):
+        return "audio/wav"
+    return best
+
+
+def _assemble_audio(chunks: list[np.ndarray], lengths: list[int], media_type: str) -> bytes:
+    """
+    Copy int16 chunks into one preallocated buffer, padded with silence to
+    prevent clipping at start/end of playback, and encode it as `media_type`.
+    """
+    combined = np.empty(2 * PAD_SAMPLES + sum(lengths), dtype=np.int16)
+    combined[:PAD_SAMPLES] = 0
+    off = PAD_SAMPLES
+    for audio_np, length in zip(chunks, lengths):
+        combined[off:off + length] = audio_np
+        off += length
+    combined[off:] = 0
+
+    if media_type not in AUDIO_FORMATS:
+        return _pcm_to_wav(combined, SAMPLE_RATE)
+    fmt, subtype = AUDIO_FORMATS[media_type]
+    buf = io.BytesIO()
+    sf.write(buf, combined, SAMPLE_RATE, format=fmt, subtype=subtype)
+    return buf.getvalue()
+
+
+def _synthesize_body(audio: bytes, timestamps: list[dict], media_type: str) -> bytes:
+    """SynthesizeResponse-shaped JSON body, serialized by orjson without model validation."""
+    content = {
+        "audio": base64.b64encode(audio).decode(),
+        "timestamps": timestamps,
+        "sample_rate": SAMPLE_RATE,
+        "format": media_type,
+    }
+    return orjson.dumps(content)
+
+
+# Response assembly (buffer copy, audio encode, base64, JSON) is O(audio length) CPU
+# work; it runs here so long responses never stall the event loop
+ENCODER = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kokoro-encode")
+
+
+async def _synthesize_response(audio: bytes, timestamps: list[dict], media_type: str) -> Response:
+    body = await asyncio.get_running_loop().run_in_executor(ENCODER, _synthesize_body, audio, timestamps, media_type)
+    return Response(content=body, media_type="application/json")
+
+
+_has_alnum = re.compile(r"[^\W_]").search  # any letter or digit, like str.isalnum
+
+
+# Raw per-chunk word timings: (words, starts, ends), seconds from the chunk start
+ChunkTimestamps = tuple[list[str], np.ndarray, np.ndarray]
+
+
+def _extract_word_timestamps(tokens: list | None, graphemes: str, pred_dur, audio_len: int) -> ChunkTimestamps:
     """
     Extract per-word timestamps. Uses MToken objects when available (English),
-    falls back to pred_dur-based estimation for other languages.
+    falls back to pred_dur-based estimation for other languages. Times are left
+    unrounded; _offset_timestamps shifts and rounds them once.
     """
     # Try MToken-based timestamps first
     if tokens:
-        timestamps: list[WordTimestamp] = []
+        words: list[str] = []
+        starts: list[float] = []
+        ends: list[float] = []
         for token in tokens:
-            text = getattr(token, "text", "")
-            start = getattr(token, "start_ts", None)
-            end = getattr(token, "end_ts", None)
-
+            start, end = token.start_ts, token.end_ts
             if start is None or end is None:
                 continue
 
             # Skip punctuation-only tokens (merge timing into previous word)
-            if not any(c.isalnum() for c in text):
-                if timestamps:
-                    timestamps[-1].end = round(end, 4)
+            text = token.text
+            if not _has_alnum(text):
+                if ends:
+                    ends[-1] = end
                 continue
 
-            timestamps.append(WordTimestamp(word=text, start=round(start, 4), end=round(end, 4)))
+            words.append(text)
+            starts.append(start)
+            ends.append(end)
 
-        if timestamps:
-            return timestamps
+        if words:
+            return words, np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
 
     # Fallback: distribute audio duration across words using pred_dur
     words = graphemes.split() if graphemes else []
     if not words:
-        return []
+        return [], np.empty(0), np.empty(0)
 
     total_duration = audio_len / SAMPLE_RATE
 
     if pred_dur is not None:
-        dur_np = pred_dur.numpy() if hasattr(pred_dur, "numpy") else np.array(pred_dur)
-        total_ticks = float(dur_np.sum()) or 1.0
-
         # Map phonemes to words proportionally by character length
         # (pred_dur is phoneme-level, but we approximate per-word share)
-        char_lengths = [len(w) for w in words]
-        total_chars = sum(char_lengths) or 1
+        char_lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        ends = np.cumsum(char_lengths) * (total_duration / char_lengths.sum())
+        starts = np.concatenate(([0.0], ends[:-1]))
+    else:
+        # Last resort: even distribution
+        idx = np.arange(len(words) + 1) * (total_duration / len(words))
+        starts, ends = idx[:-1], idx[1:]
+
+    return words, starts, ends
+
+
+def _offset_timestamps(words: list[str], starts: np.ndarray, ends: np.ndarray, offsets) -> list[dict]:
+    """
+    Shift raw start/end times by `offsets` (scalar or per-word array) in one
+    vector add, round once, and build the timestamp dicts in a single pass.
+    """
+    starts = starts + offsets
+    ends = ends + offsets
+    np.round(starts, 4, out=starts)
+    np.round(ends, 4, out=ends)
+    return [{"word": w, "start": s, "end": e} for w, s, e in zip(words, starts.tolist(), ends.tolist())]
+
+
+def _iter_chunks(req: SynthesizeRequest, lang_code: str) -> Iterator[tuple[np.ndarray, ChunkTimestamps, float]]:
+    """
+    Run Kokoro on the request with the `lang_code` pipeline and yield
+    (int16 audio, timestamps, offset) per generated chunk. Timestamps are
+    relative to the chunk; `offset` is the running start time of the chunk in
+    seconds, for the caller to apply.
+    """
+    pipe = _get_pipeline(lang_code)
+
+    audio_offset = 0.0  # running offset in seconds across chunks
+
+    generator = pipe(req.text, voice=req.voice, speed=req.speed, model=batcher.wrap(pipe.model))
+
+    # No autograd anywhere in synthesis. The generator is drained on a single
+    # worker thread, so the mode holds across its yields.
+    with torch.inference_mode():
+        for result in generator:
+            # Every consumer wants int16 PCM, so convert once here
+            audio_np = _to_pcm16(result.audio.numpy() if hasattr(result.audio, "numpy") else np.array(result.audio))
+
+            # Extract word timestamps (precise from MTokens, or fallback from pred_dur)
+            tokens = getattr(result, "tokens", None)
+            graphemes = getattr(result, "graphemes", "") or ""
+            pred_dur = getattr(result, "pred_dur", None)
+            chunk_ts = _extract_word_timestamps(tokens, graphemes, pred_dur, len(audio_np))
+
+            yield audio_np, chunk_ts, audio_offset
+            audio_offset += len(audio_np) / SAMPLE_RATE
 
-        timestamps = []
-        cursor = 0.0
-        for word, clen in zip(words, char_lengths):
-            word_dur = (clen / total_chars) * total_duration
-            timestamps.append(WordTimestamp(word=word, start=round(cursor, 4), end=round(cursor + word_dur, 4)))
-            cursor += word_dur
-        return timestamps
 
-    # Last resort: even distribution
-    dur_per_word = total_duration / len(words)
-    return [
-        WordTimestamp(word=w, start=round(i * dur_per_word, 4), end=round((i + 1) * dur_per_word, 4))
-        for i, w in enumerate(words)
-    ]
+_CHUNKS_DONE = object()  # end-of-stream sentinel for _aiter_chunks
+_PUT_POLL_S = 0.5  # how often a worker blocked on a slow client checks whether to give up
+
+# Synthesis gets its own pool: workers blocked behind slow streaming clients
+# must not starve the default executor (asyncio.to_thread, pipeline loading)
+SYNTHESIZER = ThreadPoolExecutor(max_workers=SYNTH_WORKERS, thread_name_prefix="kokoro-synth")
+
+
+async def _aiter_chunks(req: SynthesizeRequest, lang_code: str) -> AsyncIterator[tuple[np.ndarray, ChunkTimestamps, float]]:
+    """
+    Async view of _iter_chunks. The blocking Kokoro generator runs in a worker
+    thread and hands chunks back over an asyncio.Queue, so the event loop stays
+    free to serve other requests while the model is busy. The queue is bounded:
+    when a slow client falls behind, the worker blocks instead of buffering the
+    rest of the waveform.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        """Hand `item` to the consumer, blocking while the queue is full. False once nobody will read it."""
+        if stop.is_set() or loop.is_closed():
+            return False
+        try:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        except RuntimeError:  # the loop closed in the meantime
+            return False
+        while not (stop.is_set() or loop.is_closed()):
+            try:
+                future.result(timeout=_PUT_POLL_S)
+                return True
+            except TimeoutError:
+                continue
+            except CancelledError:  # loop shutdown cancelled the put
+                return False
+        if not loop.is_closed():
+            future.cancel()
+        return False
+
+    def worker() -> None:
+        try:
+            for chunk in _iter_chunks(req, lang_code):
+                if not put(chunk):  # client went away, stop synthesizing
+                    break
+        except Exception as exc:
+            put(exc)
+        finally:
+            put(_CHUNKS_DONE)
+
+    loop.run_in_executor(SYNTHESIZER, worker)
+    try:
+        while (item := await queue.get()) is not _CHUNKS_DONE:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
 
 
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
+# VOICES never changes, so the body is encoded once and proxies may cache it
+_VOICES_BODY = orjson.dumps({"voices": VOICES})
+_VOICES_HEADERS = {"Cache-Control": "public, max-age=3600"}
+
+
 @app.get("/voices")
 async def list_voices():
-    return {"voices": VOICES}
+    return Response(content=_VOICES_BODY, media_type="application/json", headers=_VOICES_HEADERS)
 
 
 @app.post("/synthesize", response_model=SynthesizeResponse)
-async def synthesize(req: SynthesizeRequest):
+async def synthesize(req: SynthesizeRequest, request: Request):
     lang_code = _lang_for_voice(req.voice)
-    pipe = _get_pipeline(lang_code)
+    media_type = _negotiate_format(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(status_code=406, detail="Accept rules out every format we produce (WAV, Ogg Opus, FLAC)")
+    key = cache.key(req, media_type)
+    if (hit := cache.get(key)) is not None:
+        return await _synthesize_response(*hit, media_type)
 
     all_audio: list[np.ndarray] = []
-    all_timestamps: list[WordTimestamp] = []
-    audio_offset = 0.0  # running offset in seconds across chunks
-
-    generator = pipe(req.text, voice=req.voice, speed=req.speed)
-
-    for result in generator:
-        audio_np = result.audio.numpy() if hasattr(result.audio, "numpy") else np.array(result.audio)
-        chunk_duration = len(audio_np) / SAMPLE_RATE
-
-        # Extract word timestamps (precise from MTokens, or fallback from pred_dur)
-        tokens = getattr(result, "tokens", None)
-        graphemes = getattr(result, "graphemes", "") or ""
-        pred_dur = getattr(result, "pred_dur", None)
-        chunk_ts = _extract_word_timestamps(tokens, graphemes, pred_dur, len(audio_np))
-
-        # Shift timestamps by the running audio offset
-        for ts in chunk_ts:
-            all_timestamps.append(
-                WordTimestamp(
-                    word=ts.word,
-                    start=round(ts.start + audio_offset, 4),
-                    end=round(ts.end + audio_offset, 4),
-                )
-            )
-
-        audio_offset += chunk_duration
+    lengths: list[int] = []
+    words: list[str] = []
+    starts: list[np.ndarray] = []
+    ends: list[np.ndarray] = []
+    chunk_offsets: list[float] = []
+    chunk_counts: list[int] = []
+
+    async for audio_np, (chunk_words, chunk_starts, chunk_ends), audio_offset in _aiter_chunks(req, lang_code):
         all_audio.append(audio_np)
+        lengths.append(len(audio_np))
+        words.extend(chunk_words)
+        starts.append(chunk_starts)
+        ends.append(chunk_ends)
+        chunk_offsets.append(audio_offset)
+        chunk_counts.append(len(chunk_words))
 
     if not all_audio:
-        return SynthesizeResponse(audio="", timestamps=[], sample_rate=SAMPLE_RATE)
+        return await _synthesize_response(b"", [], media_type)
 
-    # Pad with silence to prevent clipping at start/end of playback
-    pad_samples = int(SAMPLE_RATE * 0.08)  # 80ms
-    silence = np.zeros(pad_samples, dtype=np.float32)
-    combined = np.concatenate([silence, *all_audio, silence])
+    # Shift each word by its chunk's offset plus the leading silence: the two
+    # offsets are summed per chunk, so every word is shifted exactly once
+    offsets = np.repeat(np.asarray(chunk_offsets) + PAD_SECONDS, chunk_counts)
+    all_timestamps = _offset_timestamps(words, np.concatenate(starts), np.concatenate(ends), offsets)
 
-    # Shift timestamps to account for the leading silence
-    pad_seconds = pad_samples / SAMPLE_RATE
-    for ts in all_timestamps:
-        ts.start = round(ts.start + pad_seconds, 4)
-        ts.end = round(ts.end + pad_seconds, 4)
+    audio = await asyncio.get_running_loop().run_in_executor(ENCODER, _assemble_audio, all_audio, lengths, media_type)
+    all_audio.clear()
+    cache.put(key, audio, all_timestamps)
 
-    audio_b64 = _audio_to_base64_wav(combined, SAMPLE_RATE)
+    return await _synthesize_response(audio, all_timestamps, media_type)
 
-    return SynthesizeResponse(
-        audio=audio_b64,
-        timestamps=all_timestamps,
-        sample_rate=SAMPLE_RATE,
-    )
+
+@app.post("/synthesize/stream")
+async def synthesize_stream(req: SynthesizeRequest):
+    """
+    Stream a WAV file as Kokoro generates it: an open-ended RIFF header followed
+    by int16 PCM per chunk. Word timestamps are available via /synthesize/events.
+    """
+    lang_code = _lang_for_voice(req.voice)
+    if (hit := cache.get(cache.key(req))) is not None:
+        return Response(content=hit[0], media_type="audio/wav")
+
+    async def generate() -> AsyncIterator[bytes]:
+        yield _wav_header(SAMPLE_RATE)
+        yield _SILENCE_PCM
+        async for audio_np, _, _ in _aiter_chunks(req, lang_code):
+            yield audio_np.tobytes()
+        yield _SILENCE_PCM
+
+    return StreamingResponse(generate(), media_type="audio/wav")
+
+
+@app.post("/synthesize/events")
+async def synthesize_events(req: SynthesizeRequest):
+    """
+    Server-sent events carrying each chunk's int16 PCM (base64) alongside its
+    word timestamps, so clients can start playback and highlighting together.
+    Timestamps include the same leading silence as /synthesize.
+    """
+    lang_code = _lang_for_voice(req.voice)
+
+    async def generate() -> AsyncIterator[bytes]:
+        start = {"sample_rate": SAMPLE_RATE, "pad_samples": PAD_SAMPLES}
+        yield b"event: start\ndata: " + orjson.dumps(start) + b"\n\n"
+        async for audio_np, chunk_ts, audio_offset in _aiter_chunks(req, lang_code):
+            timestamps = _offset_timestamps(*chunk_ts, audio_offset + PAD_SECONDS)
+            payload = {
+                "audio": base64.b64encode(audio_np.tobytes()).decode(),
+                "timestamps": timestamps,
+            }
+            yield b"event: chunk\ndata: " + orjson.dumps(payload) + b"\n\n"
+        yield b"event: done\ndata: {}\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
 
 
 if __name__ == "__main__":
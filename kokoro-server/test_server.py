@@ -0,0 +1,105 @@
+"""
+Tests for the server's batched model forward and audio format negotiation.
+
+    pip install pytest
+    python -m pytest test_server.py
+"""
+
+import string
+
+import pytest
+import torch
+from kokoro import KModel
+
+from server import _forward_batch, _negotiate_format
+
+# Small random-weight Kokoro: same architecture, a fraction of the width. The
+# style vector stays 2 × 128 because KModel.forward slices ref_s at 128.
+CONFIG = {
+    "istftnet": {
+        "upsample_kernel_sizes": [20, 12], "upsample_rates": [10, 6],
+        "gen_istft_hop_size": 5, "gen_istft_n_fft": 20,
+        "resblock_dilation_sizes": [[1, 3, 5], [1, 3, 5], [1, 3, 5]],
+        "resblock_kernel_sizes": [3, 7, 11], "upsample_initial_channel": 64,
+    },
+    "dim_in": 64, "dropout": 0.2, "hidden_dim": 64, "max_conv_dim": 64, "max_dur": 50,
+    "multispeaker": True, "n_layer": 3, "n_mels": 80, "n_token": 178, "style_dim": 128,
+    "text_encoder_kernel_size": 5,
+    "plbert": {
+        "hidden_size": 32, "num_attention_heads": 2, "intermediate_size": 64,
+        "max_position_embeddings": 512, "num_hidden_layers": 2, "dropout": 0.1,
+    },
+    "vocab": {c: i + 1 for i, c in enumerate(string.ascii_letters + " .,")},
+}
+
+
+class _DecoderInputs(torch.nn.Module):
+    """Decoder stand-in that returns its inputs: the real one adds random noise."""
+
+    def forward(self, asr, F0_curve, N, s):
+        return torch.cat([asr.flatten(), F0_curve.flatten(), N.flatten(), s.flatten()])
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    weights = tmp_path_factory.mktemp("kokoro") / "empty.pth"
+    torch.save({}, weights)
+    torch.manual_seed(0)
+    model = KModel(repo_id="hexgrad/Kokoro-82M", config=CONFIG, model=str(weights)).eval()
+    model.decoder = _DecoderInputs()
+    return model
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_forward_batch_matches_model(model, seed):
+    generator = torch.Generator().manual_seed(seed)
+    texts = ["hi", "hello world", "a much longer sentence, to pad the others.", "short one."]
+    # Slow speeds scale durations up, so any drift in the predictor shows up after rounding
+    batch = [(text, torch.randn(1, 256, generator=generator), 0.1 + 0.05 * i) for i, text in enumerate(texts)]
+
+    outputs = _forward_batch(model, batch)
+
+    assert len(outputs) == len(batch)
+    for (phonemes, ref_s, speed), (audio, pred_dur) in zip(batch, outputs):
+        expected = model(phonemes, ref_s, speed, return_output=True)
+        assert torch.equal(pred_dur, expected.pred_dur)
+        assert audio.shape == expected.audio.shape
+        torch.testing.assert_close(audio, expected.audio, rtol=1e-4, atol=1e-4)
+
+
+def test_forward_batch_single_row_matches_model(model):
+    ref_s = torch.randn(1, 256, generator=torch.Generator().manual_seed(0))
+
+    [(audio, pred_dur)] = _forward_batch(model, [("hello world", ref_s, 0.2)])
+
+    expected = model("hello world", ref_s, 0.2, return_output=True)
+    assert torch.equal(pred_dur, expected.pred_dur)
+    torch.testing.assert_close(audio, expected.audio, rtol=1e-4, atol=1e-4)
+
+
+OPUS = "audio/ogg; codecs=opus"
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, "audio/wav"),
+    ("", "audio/wav"),
+    ("application/json", "audio/wav"),
+    ("audio/flac, audio/ogg", "audio/flac"),
+    ("audio/flac;q=0.5, audio/ogg;q=0.9", OPUS),
+    ("audio/ogg;q=0, audio/wav", "audio/wav"),
+    ("audio/ogg;q=0", "audio/wav"),
+    ("audio/ogg;q=abc", "audio/wav"),
+    ("audio/FLAC ;Q=1", "audio/flac"),
+    ("text/html, audio/opus; q=0.3", OPUS),
+    ('audio/ogg; codecs="opus"', OPUS),
+    ("audio/ogg; codecs=vorbis, audio/flac;q=0.1", "audio/flac"),
+    ("audio/ogg; codecs=vorbis", "audio/wav"),
+    ("audio/flac;q=0.5, */*", "audio/wav"),
+    ("audio/wav;q=0, audio/*", None),
+    ("audio/wav;q=0, audio/*, audio/flac;q=0.2", "audio/flac"),
+    ("audio/wav;q=0", None),
+    ("*/*;q=0", None),
+    ("audio/*;q=0, audio/flac", "audio/flac"),
+])
+def test_negotiate_format(accept, expected):
+    assert _negotiate_format(accept) == expected
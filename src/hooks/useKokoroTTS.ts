@@ -113,13 +113,13 @@ export function useKokoroTTS({ config, onWordBoundary, onEnd }: UseKokoroTTSOpti
         const data = await res.json();
         if (!data.audio) return null;
 
-        // Decode base64 WAV to Blob
+        // Decode base64 audio to Blob
         const raw = atob(data.audio);
         const bytes = new Uint8Array(raw.length);
         for (let i = 0; i < raw.length; i++) {
           bytes[i] = raw.charCodeAt(i);
         }
-        const audioBlob = new Blob([bytes], { type: "audio/wav" });
+        const audioBlob = new Blob([bytes], { type: data.format ?? "audio/wav" });
 
         // Convert server timestamps to word timings
         const serverTimestamps: ServerTimestamp[] = data.timestamps ?? [];